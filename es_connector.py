@@ -1,22 +1,57 @@
 from elasticsearch import Elasticsearch
-from elasticsearch.helpers import bulk
+from elasticsearch.helpers import streaming_bulk
 import elasticsearch.helpers
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc
+import msgpack
+import zstandard as zstd
+import redis
+import io
 from pathlib import Path
-import pickle
+import json
+import os
+import tempfile
 import logging
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import itertools
+from operator import itemgetter
 from datetime import datetime
+import time
 import hashlib
 
 from es_queries import ElasticsearchQueries
 
 # set config parameters
-cache_dir = Path('C:\tmp\pickle')
+cache_dir = Path(os.environ.get('ES_CACHE_DIR', tempfile.gettempdir())) / 'es_cache'
 cache_dir.mkdir(parents=True, exist_ok=True)
 caching_on = True
+cache_compression_level = 3
 request_timeout=30
+force_merge_timeout = 3600
+index_exists_ttl = 60
+bulk_thread_count = os.cpu_count() or 8
+bulk_queue_size = 4
+bulk_max_chunk_bytes = 50 * 1024 * 1024
+bulk_max_chunk_size = 12500
+bulk_max_retries = 3
+bulk_initial_backoff = 2
+arrow_batch_size = 50000
+redis_on = False
+redis_host = 'localhost'
+redis_port = 6379
+redis_ttl = 900
+redis_retry_interval = 60
+
+DF_CACHE_SUFFIX = '.df.zst'
+OBJ_CACHE_SUFFIX = '.msgpack.zst'
+CACHE_SUFFIXES = (DF_CACHE_SUFFIX, OBJ_CACHE_SUFFIX)
+REDIS_KEY_PREFIX = 'esdf:'
+# metadata columns which are never indexed as part of document source
+METADATA_COLUMNS = ('_id',)
+CORRUPT_CACHE_ERRORS = (EOFError, ValueError, OSError, pa.ArrowException, zstd.ZstdError)
 
 # initialise logger
 logger = logging.getLogger('elasticsearch_connector')
@@ -27,6 +62,447 @@ console_handler.setFormatter(formatter)
 logger.addHandler(console_handler)
 logger.setLevel(logging.DEBUG)
 
+# redis clients by (host, port)
+redis_clients = {}
+redis_down_until = 0
+
+
+def is_arrow_column(column):
+    '''
+    Checks whether dataframe column round-trips through arrow unchanged.
+    Object columns are only stored in arrow if they hold nothing but strings.
+    :param column: pandas.Series
+    :return: Boolean
+    '''
+    if column.dtype != object:
+        return True
+    return pd.api.types.infer_dtype(column, skipna=False) == 'string'
+
+
+def pack_df(df):
+    '''
+    Serializes dataframe into bytes. Columns which round-trip through arrow are stored in arrow
+    ipc stream format, remaining object columns (mixed types, lists, dicts) are stored using msgpack.
+    :param df: pandas.DataFrame
+    :return: bytes
+    '''
+    arrow_columns = [column for column in df.columns if is_arrow_column(df[column])]
+    table = pa.Table.from_pandas(df[arrow_columns], preserve_index=False)
+    buffer = pa.BufferOutputStream()
+    writer = pa.ipc.new_stream(buffer, table.schema)
+    writer.write_table(table)
+    writer.close()
+
+    data = {
+        'columns': list(df.columns),
+        'num_rows': len(df),
+        'arrow': buffer.getvalue().to_pybytes(),
+        'objects': {column: df[column].tolist() for column in df.columns if column not in arrow_columns}
+    }
+    return msgpack.packb(data, use_bin_type=True)
+
+
+def unpack_df(blob):
+    '''
+    Deserializes dataframe packed by pack_df.
+    :param blob: bytes
+    :return: pandas.DataFrame
+    '''
+    data = msgpack.unpackb(blob, raw=False)
+    out = pa.ipc.open_stream(data['arrow']).read_all().to_pandas()
+    if len(out.columns) == 0:
+        out = pd.DataFrame(index=pd.RangeIndex(data['num_rows']))
+
+    # insert object columns at their original positions
+    for position, column in enumerate(data['columns']):
+        if column in data['objects']:
+            out.insert(position, column, pd.Series(data['objects'][column], index=out.index, dtype=object))
+    return out
+
+
+def dump_cache(result, output):
+    '''
+    Writes given result into a binary file as a zstd compressed stream.
+    Dataframes are stored using pack_df, other objects are stored using msgpack.
+    :param result: pandas.DataFrame or msgpack serializable object
+    :param output: binary file object
+    :return: None
+    '''
+    if isinstance(result, pd.DataFrame):
+        data = pack_df(result)
+    else:
+        data = msgpack.packb(result, use_bin_type=True)
+
+    compressor = zstd.ZstdCompressor(level=cache_compression_level).stream_writer(output)
+    compressor.write(data)
+    compressor.flush(zstd.FLUSH_FRAME)
+
+
+def load_cache(input, suffix):
+    '''
+    Reads a result written by dump_cache from a binary file.
+    :param input: binary file object
+    :param suffix: str, cache file suffix identifying serialization format
+    :return: pandas.DataFrame or deserialized object
+    '''
+    data = zstd.ZstdDecompressor().stream_reader(input).read()
+    if suffix == DF_CACHE_SUFFIX:
+        return unpack_df(data)
+    return msgpack.unpackb(data, raw=False)
+
+
+def get_cache_suffix(result):
+    '''
+    Returns cache file suffix for given result.
+    :param result: object
+    :return: str
+    '''
+    if isinstance(result, pd.DataFrame):
+        return DF_CACHE_SUFFIX
+    return OBJ_CACHE_SUFFIX
+
+
+def get_cache_subdir(cache_fname):
+    '''
+    Returns directory for cache files with given name. Cache files are spread over two levels
+    of subdirectories named after a hash of the file name, so no directory grows too large.
+    :param cache_fname: str
+    :return: pathlib.Path
+    '''
+    fname_hash = hashlib.blake2b(cache_fname.encode('utf-8'), digest_size=16).hexdigest()
+    return cache_dir / fname_hash[:2] / fname_hash[2:4]
+
+
+def write_cache_file(cache_fpath, blob):
+    '''
+    Writes cache file atomically. Data is written and synced into a unique temporary file first,
+    so neither a crash nor concurrent writers leave a partially written cache file.
+    :param cache_fpath: pathlib.Path
+    :param blob: bytes
+    :return: None
+    '''
+    output = tempfile.NamedTemporaryFile(dir=str(cache_fpath.parent), suffix='.tmp', delete=False)
+    try:
+        with output:
+            output.write(blob)
+            output.flush()
+            os.fsync(output.fileno())
+        os.replace(output.name, str(cache_fpath))
+    except Exception:
+        os.unlink(output.name)
+        raise
+
+
+def remove_corrupt_cache_file(cache_fpath, blob):
+    '''
+    Removes corrupt cache file unless another process has already removed or replaced it.
+    :param cache_fpath: pathlib.Path
+    :param blob: bytes, corrupt content read from the file
+    :return: None
+    '''
+    try:
+        with open(cache_fpath, 'rb') as input:
+            if input.read() != blob:
+                return
+        cache_fpath.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def get_bulk_chunk_size(df):
+    '''
+    Estimates a number of documents per bulk request so that a chunk fits into bulk_max_chunk_bytes.
+    Average document size is approximated with the size of the first row.
+    :param df: pandas.DataFrame
+    :return: int
+    '''
+    if df.empty:
+        return bulk_max_chunk_size
+    avg_doc_size = len(json.dumps(df.iloc[0].to_dict(), default=str).encode('utf-8'))
+    return max(1, min(bulk_max_chunk_size, bulk_max_chunk_bytes // avg_doc_size))
+
+
+def iter_bulk_actions(df, es_index_name):
+    '''
+    Lazily generates bulk index actions from dataframe rows, so the whole dataframe
+    is never materialised as a list of dicts. Actions have no _id, so elasticsearch
+    generates ids and doesn't need to look up existing documents on insert.
+    :param df: pandas.DataFrame
+    :param es_index_name: str
+    :return: generator of dicts
+    '''
+    # object arrays hold python scalars and timestamps which elasticsearch can serialize
+    columns = [
+        (column, df[column].astype(object).to_numpy())
+        for column in df.columns if column not in METADATA_COLUMNS
+    ]
+    for i in range(len(df)):
+        yield {
+            '_index': es_index_name,
+            '_source': {column: values[i] for column, values in columns}
+        }
+
+
+def bulk_index_chunk(client, actions, es_index_name):
+    '''
+    Indexes one chunk of bulk actions. Documents rejected by busy elasticsearch (status 429)
+    are retried up to bulk_max_retries times with exponential backoff.
+    :param client: elasticsearch.Elasticsearch
+    :param actions: list of dicts
+    :param es_index_name: str
+    :return: int, number of documents which failed to index
+    '''
+    failures = 0
+    for success, info in streaming_bulk(
+        client=client,
+        actions=actions,
+        index=es_index_name,
+        chunk_size=len(actions),
+        max_chunk_bytes=bulk_max_chunk_bytes,
+        max_retries=bulk_max_retries,
+        initial_backoff=bulk_initial_backoff,
+        # documents are only retried if errors are not raised straight away
+        raise_on_error=False,
+        request_timeout=request_timeout
+    ):
+        if not success:
+            failures += 1
+            logger.error('failed to index document: {}'.format(info))
+    return failures
+
+
+def bulk_index(client, actions, es_index_name, chunk_size):
+    '''
+    Indexes bulk actions in chunks using bulk_thread_count threads. At most bulk_queue_size
+    chunks wait for a free thread, so actions are consumed lazily.
+    :param client: elasticsearch.Elasticsearch
+    :param actions: iterable of dicts
+    :param es_index_name: str
+    :param chunk_size: int
+    :return: int, number of documents which failed to index
+    '''
+    failures = 0
+    actions = iter(actions)
+    with ThreadPoolExecutor(max_workers=bulk_thread_count) as executor:
+        pending = set()
+        for chunk in iter(lambda: list(itertools.islice(actions, chunk_size)), []):
+            if len(pending) >= bulk_thread_count + bulk_queue_size:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                failures += sum(future.result() for future in done)
+            pending.add(executor.submit(bulk_index_chunk, client, chunk, es_index_name))
+        failures += sum(future.result() for future in pending)
+    return failures
+
+
+class ColumnBuilder:
+    '''
+    Collects values of one dataframe column and converts them into arrow arrays batch by batch.
+    Columns whose values don't share a flat arrow type are kept as python objects.
+    '''
+
+    def __init__(self, num_missing=0):
+        '''
+        :param num_missing: int, number of preceding rows without this column
+        '''
+        self.values = [None] * num_missing
+        self.chunks = []
+        self.type = None
+        self.objects = None
+
+
+    def flush(self):
+        '''
+        Converts collected values into an arrow array.
+        :return: None
+        '''
+        if self.objects is not None:
+            self.objects.extend(self.values)
+            self.values = []
+            return
+
+        try:
+            chunk = pa.array(self.values)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+            # e.g. mixed types or integers outside int64
+            self.to_objects()
+            return
+
+        if chunk.type == pa.null():
+            if self.type is None:
+                # keep values until their type is known
+                return
+            chunk = pa.array(self.values, type=self.type)
+        elif pa.types.is_nested(chunk.type):
+            # keep lists and dicts as python objects, like pandas does
+            self.to_objects()
+            return
+        elif self.type is not None and chunk.type != self.type:
+            chunk = self.promote(chunk)
+            if chunk is None:
+                self.to_objects()
+                return
+
+        self.type = chunk.type
+        self.chunks.append(chunk)
+        self.values = []
+
+
+    def promote(self, chunk):
+        '''
+        Promotes integer and float chunks to a common float type.
+        :param chunk: pyarrow.Array
+        :return: pyarrow.Array or None if chunk can't be stored with preceding chunks
+        '''
+        types = (self.type, chunk.type)
+        if not all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in types):
+            return None
+
+        try:
+            chunks = [c.cast(pa.float64()) for c in self.chunks]
+            chunk = chunk.cast(pa.float64())
+        except pa.ArrowInvalid:
+            # integers above 2 ** 53 lose precision as floats
+            return None
+        self.chunks = chunks
+        return chunk
+
+
+    def to_objects(self):
+        '''
+        Switches the column to python objects.
+        :return: None
+        '''
+        self.objects = [value for chunk in self.chunks for value in chunk.to_pylist()]
+        self.objects.extend(self.values)
+        self.chunks = []
+        self.values = []
+
+
+    def finish(self):
+        '''
+        Returns all collected values.
+        :return: pyarrow.ChunkedArray or list
+        '''
+        self.flush()
+        if self.objects is not None:
+            return self.objects
+        if self.type is None:
+            # column has no values other than None
+            return self.values
+        return pa.chunked_array(self.chunks, type=self.type)
+
+
+def build_df(hits, columns=None):
+    '''
+    Builds a dataframe column by column from elasticsearch hits.
+    Columns are discovered from hits' sources if they are not given.
+    Values are converted into arrow arrays every arrow_batch_size hits, so python objects
+    of the whole result are never held in memory at once.
+    :param hits: iterable of dicts
+    :param columns: list
+    :return: pandas.DataFrame
+    '''
+    builders = {column: ColumnBuilder() for column in columns or ()}
+    num_rows = 0
+    try:
+        for source in map(itemgetter('_source'), hits):
+            if not columns:
+                for column in source:
+                    if column not in builders:
+                        builders[column] = ColumnBuilder(num_missing=num_rows)
+
+            for column, builder in builders.items():
+                builder.values.append(source.get(column))
+            num_rows += 1
+
+            if num_rows % arrow_batch_size == 0:
+                for builder in builders.values():
+                    builder.flush()
+    except Exception as e:
+        logger.error('failed after {} hits with message: {}'.format(num_rows, e))
+        raise
+
+    data = {column: builder.finish() for column, builder in builders.items()}
+    arrow_columns = [column for column, values in data.items() if isinstance(values, pa.ChunkedArray)]
+    if arrow_columns:
+        table = pa.Table.from_arrays([data.pop(column) for column in arrow_columns], names=arrow_columns)
+        out = table.to_pandas(split_blocks=True, self_destruct=True)
+        del table
+    else:
+        out = pd.DataFrame(index=pd.RangeIndex(num_rows))
+
+    # insert columns stored as python objects at their original positions
+    for position, column in enumerate(builders):
+        if column in data:
+            out.insert(position, column, pd.Series(data[column], index=out.index, dtype=object))
+    return out
+
+
+def redis_available():
+    '''
+    Checks whether redis cache should be used. Redis is skipped for redis_retry_interval seconds
+    after it failed, so an unreachable server doesn't slow down every cached call.
+    :return: Boolean
+    '''
+    return redis_on and time.monotonic() >= redis_down_until
+
+
+def redis_failed(e):
+    '''
+    Records redis failure.
+    :param e: redis.RedisError
+    :return: None
+    '''
+    global redis_down_until
+    redis_down_until = time.monotonic() + redis_retry_interval
+    logger.debug('redis cache is not available: {}'.format(e))
+
+
+def get_redis_client():
+    '''
+    Returns redis client for current redis_host and redis_port. Client connects lazily on first command.
+    :return: redis.Redis
+    '''
+    address = (redis_host, redis_port)
+    if address not in redis_clients:
+        redis_clients[address] = redis.Redis(
+            host=redis_host,
+            port=redis_port,
+            socket_timeout=1,
+            socket_connect_timeout=1
+        )
+    return redis_clients[address]
+
+
+def redis_get(keys):
+    '''
+    Gets cached blobs from redis. Redis errors are not raised, missing blobs are returned instead.
+    :param keys: list of str
+    :return: list of bytes or None
+    '''
+    if not redis_available():
+        return [None] * len(keys)
+    try:
+        return get_redis_client().mget(keys)
+    except redis.RedisError as e:
+        redis_failed(e)
+        return [None] * len(keys)
+
+
+def redis_set(key, blob):
+    '''
+    Stores cached blob in redis for redis_ttl seconds. Redis errors are not raised.
+    :param key: str
+    :param blob: bytes
+    :return: None
+    '''
+    if not redis_available():
+        return
+    try:
+        get_redis_client().set(key, blob, ex=redis_ttl)
+    except redis.RedisError as e:
+        redis_failed(e)
+
 
 def cacheable(method):
     '''
@@ -48,39 +524,72 @@ def cacheable(method):
         if isinstance(end_date, datetime):
             end_date = end_date.strftime('%Y-%m-%d')
 
-        # convert list of dicts to a list of tuples
-        query_params = []
-
-        query_params_must = kwargs.get('query_params_must')
-        if isinstance(query_params_must, list):
-            for i in query_params_must:
-                query_params.extend([(key, value) for key, value in i.items()])
-
-        query_params_must_not = kwargs.get('query_params_must_not')
-        if isinstance(query_params_must_not, list):
-            query_params.extend([(key, value) for key, value in query_params_must_not])
+        # convert query params into sorted tuples for checksums consistency,
+        # each must param stays a separate group since groups are OR-ed
+        query_params_must = kwargs.get('query_params_must') or ()
+        query_params_must_not = kwargs.get('query_params_must_not') or ()
+        must = tuple(sorted(tuple(sorted(param.items())) for param in query_params_must))
+        must_not = tuple(sorted(query_params_must_not))
+        columns = tuple(kwargs.get('columns') or ())
 
         # build unique cache file name for given method parameters
         cache_fname = '{}_{}_from_{}_to_{}'.format(method.__name__, es_index_name, start_date, end_date)
+        sort_by = kwargs.get('sort_by')
+        if sort_by:
+            cache_fname += '_sorted_by_{}'.format(sort_by)
 
-        if len(query_params) > 0:
-            # sort tuples for checksums consistency
-            query_params.sort()
-            query_params = hashlib.md5(str(query_params).encode('utf-8')).hexdigest()
+        if must or must_not or columns:
+            query_params = (must, must_not, columns)
+            query_params = hashlib.blake2b(repr(query_params).encode('utf-8'), digest_size=16).hexdigest()
             cache_fname += '_{}'.format(query_params)
 
-        result = None
-        cache_fpath = cache_dir / '{}.pickle'.format(cache_fname)
-        if cache_fpath.is_file():
-            with open(cache_fpath, 'rb') as input:
-                result = pickle.load(input)
-                logger.debug('located cached data in {}'.format(cache_fpath))
-                return result
-        else:
-            result = method(*args, **kwargs)
-            with open(cache_fpath, 'wb') as output:
-                pickle.dump(result, output, pickle.HIGHEST_PROTOCOL)
-                logger.debug('cached data into {}'.format(cache_fpath))
+        # look up redis first, then cache files
+        redis_keys = [REDIS_KEY_PREFIX + cache_fname + suffix for suffix in CACHE_SUFFIXES]
+        for suffix, blob in zip(CACHE_SUFFIXES, redis_get(redis_keys)):
+            if blob is not None:
+                try:
+                    result = load_cache(io.BytesIO(blob), suffix)
+                    logger.debug('located cached data in redis: {}'.format(cache_fname))
+                    return result
+                except CORRUPT_CACHE_ERRORS as e:
+                    logger.error('failed to read cached data from redis: {}'.format(e))
+
+        cache_subdir = get_cache_subdir(cache_fname)
+        for suffix, redis_key in zip(CACHE_SUFFIXES, redis_keys):
+            cache_fpath = cache_subdir / '{}{}'.format(cache_fname, suffix)
+            try:
+                with open(cache_fpath, 'rb') as input:
+                    blob = input.read()
+            except FileNotFoundError:
+                # missing or just removed by another process
+                continue
+
+            try:
+                result = load_cache(io.BytesIO(blob), suffix)
+            except CORRUPT_CACHE_ERRORS as e:
+                logger.error('removing corrupt cached data in {}: {}'.format(cache_fpath, e))
+                remove_corrupt_cache_file(cache_fpath, blob)
+                continue
+            logger.debug('located cached data in {}'.format(cache_fpath))
+            redis_set(redis_key, blob)
+            return result
+
+        result = method(*args, **kwargs)
+
+        try:
+            suffix = get_cache_suffix(result)
+            output = io.BytesIO()
+            dump_cache(result, output)
+            blob = output.getvalue()
+
+            cache_subdir.mkdir(parents=True, exist_ok=True)
+            cache_fpath = cache_subdir / '{}{}'.format(cache_fname, suffix)
+            write_cache_file(cache_fpath, blob)
+            logger.debug('cached data into {}'.format(cache_fpath))
+
+            redis_set(REDIS_KEY_PREFIX + cache_fname + suffix, blob)
+        except Exception as e:
+            logger.error('failed to cache data for {} with message: {}'.format(cache_fname, e))
         return result
     return wrapper
 
@@ -88,25 +597,58 @@ def cacheable(method):
 class ElasticsearchConnector:
 
     def __init__(self, host, port):
-        self.es = Elasticsearch([
-            {
-                'host': host,
-                'prot': port
-            }
-        ])
+        self.es = Elasticsearch(
+            hosts=[
+                {
+                    'host': host,
+                    'port': port
+                }
+            ],
+            http_compress=True,
+            # allow enough pooled connections for bulk threads
+            maxsize=max(25, bulk_thread_count * 2),
+            retry_on_timeout=True,
+            max_retries=3,
+            timeout=request_timeout
+        )
+        # index name -> time when the index was last known to exist
+        self.known_indices = {}
+
+
+    def index_exists(self, es_index_name):
+        '''
+        Checks whether elasticsearch index exists.
+        Existing indices are remembered for index_exists_ttl seconds to save round-trips to elasticsearch.
+        :param es_index_name: str
+        :return: Boolean
+        '''
+        now = time.monotonic()
+        checked_at = self.known_indices.get(es_index_name)
+        if checked_at is not None and now - checked_at < index_exists_ttl:
+            return True
+
+        exists = self.es.indices.exists(es_index_name)
+        if exists:
+            self.known_indices[es_index_name] = now
+        else:
+            self.known_indices.pop(es_index_name, None)
+        return exists
 
 
-    def create_es_index(self, es_index_name, column_types):
+    def create_es_index(self, es_index_name, column_types, bulk_load=False):
         '''
         Creates new elasticsearch index.
+        Index created for bulk load must be finished with finish_bulk_load.
         :param es_index_name: str
         :param column_types: list
+        :param bulk_load: Boolean
         :return: None
         '''
         logger.debug('creating es index: {}'.format(es_index_name))
         body = ElasticsearchQueries.get_query_create_new_index(
             es_index_name=es_index_name,
-            columns=column_types
+            columns=column_types,
+            bulk_load=bulk_load
         )
         try:
             result = self.es.indices.create(
@@ -114,11 +656,12 @@ class ElasticsearchConnector:
                 ignore=400,
                 body=body
             )
-            if not result.get('acknowledge'):
+            if not result.get('acknowledged'):
                 logger.error('failed to create index: {}'.format(es_index_name))
                 return False
 
             logger.debug('create index: {}'.format(es_index_name))
+            self.known_indices[es_index_name] = time.monotonic()
             return True
 
         except Exception as e:
@@ -126,6 +669,37 @@ class ElasticsearchConnector:
             return False
 
 
+    def finish_bulk_load(self, es_index_name, force_merge=True):
+        '''
+        Restores settings of an index created for bulk load and optionally merges its segments.
+        :param es_index_name: str
+        :param force_merge: Boolean
+        :return: Boolean, whether index settings were restored
+        '''
+        try:
+            self.es.indices.put_settings(
+                index=es_index_name,
+                body=ElasticsearchQueries.get_query_finish_bulk_load(),
+                request_timeout=request_timeout
+            )
+        except Exception as e:
+            logger.error('failed to restore settings of es index: {} with message: {}'.format(es_index_name, e))
+            return False
+
+        if not force_merge:
+            return True
+
+        try:
+            self.es.indices.forcemerge(
+                index=es_index_name,
+                max_num_segments=1,
+                request_timeout=force_merge_timeout
+            )
+        except Exception as e:
+            logger.error('failed to force merge es index: {} with message: {}'.format(es_index_name, e))
+        return True
+
+
     def count_num_of_rows(self, es_index_name, start_date, end_date):
         '''
         Counts a number of rows selected for given date range.
@@ -154,19 +728,26 @@ class ElasticsearchConnector:
         '''
         Stores given dataframe in elasticsearch.
         :param es_index_name: str
-        :param doc_type: str
+        :param doc_type: str, unused since elasticsearch 7 indices are typeless
         :param df: pandas.DataFrame
         :param update: Boolean
         :return: Boolean
         '''
         # create elasticsearch index if it doesn't exist yet
-        if not self.es.indices.exists(es_index_name):
+        if not self.index_exists(es_index_name):
             logger.debug('creating es index: {}'.format(es_index_name))
+            metadata_columns = [column for column in df.columns if column in METADATA_COLUMNS]
+            if metadata_columns:
+                logger.warning('skipping columns {}, es index: {} uses auto-generated ids'.format(
+                    metadata_columns, es_index_name))
             index_dtypes = df.dtypes.to_dict()
             index_column_types = dict(map(lambda x: (x, index_dtypes[x].type), index_dtypes))
+            for column in metadata_columns:
+                del index_column_types[column]
             result = self.create_es_index(
                 es_index_name=es_index_name,
-                column_types=index_column_types
+                column_types=index_column_types,
+                bulk_load=True
             )
             if not result:
                 logger.error('failed to save df in es index: {}'.format(es_index_name))
@@ -175,23 +756,21 @@ class ElasticsearchConnector:
             # store given dataframe
             logger.debug('inserting records into es index: {}'.format(es_index_name))
 
-            docs = df.to_dict(orient='records')
-            result = bulk(
-                client=self.es,
-                actions=docs,
-                index=es_index_name,
-                doc_type=doc_type,
-                raise_on_error=True,
-                stats_only=True,
-                max_retries=3,
-                request_timeout=request_timeout
-            )
-
-            # TODO: consider an option to use parallel bulk for storing large dataframes
-            # for success, info in parallel_bulk(lient=self.es, actions=docs):
-            #     # TODO: implement parallel_bulk
-
-            if result[1] != 0:
+            failures = 0
+            loaded = False
+            try:
+                failures = bulk_index(
+                    client=self.es,
+                    actions=iter_bulk_actions(df, es_index_name),
+                    es_index_name=es_index_name,
+                    chunk_size=get_bulk_chunk_size(df)
+                )
+                loaded = failures == 0
+            finally:
+                # restore index settings even if bulk load failed, merge segments only after success
+                restored = self.finish_bulk_load(es_index_name, force_merge=loaded)
+
+            if failures > 0 or not restored:
                 logger.error('failed to save df in es index: {}'.format(es_index_name))
                 return False
             return True
@@ -205,14 +784,15 @@ class ElasticsearchConnector:
                end_date=None,
                query_params_must=None,
                query_params_must_not=None,
-               columns=None):
+               columns=None,
+               sort_by=None):
         '''
         Retrieves a dataframe from elasticsearch for given dates and optionl query parameters.
         Parameters in elasticsearch are used as follows:
         (param_name_11=value_11 AND param_name_12=value_12 AND ...) OR
         (param_name_21=value_21 AND param_name_22=value_22 AND ...) OR ...
         :param es_index_name: str
-        :param doc_type: str
+        :param doc_type: str, unused since elasticsearch 7 indices are typeless
         :param start_date: datetime
         :param end_date: datetime
         :param query_params_must: list of dicts such as:
@@ -228,9 +808,10 @@ class ElasticsearchConnector:
             ...
         ]
         :param columns: list
+        :param sort_by: str, optional column to sort results by (ascending); results are unordered otherwise
         :return: pandas.DataFrame
         '''
-        if not self.es.indices.exists(es_index_name):
+        if not self.index_exists(es_index_name):
             logger.debug('failed to get data from es index: {}'.format(es_index_name))
             return pd.DataFrame(columns=columns)
 
@@ -248,25 +829,19 @@ class ElasticsearchConnector:
                 }
             )
 
-        if query_params_must:
-            must_params = []
-            for param in query_params_must:
-                must_param = [{'match': {name: value}} for name, value in param.items()]
-                must_params.append(must_param)
+        must_not_params = [{'match': {name: value}} for name, value in query_params_must_not or ()]
 
+        if query_params_must:
+            # all should clauses share the same must_not list
             should_filters = [
                 {
                     'bool': {
-                        'must': item
+                        'must': [{'match': {name: value}} for name, value in param.items()],
+                        'must_not': must_not_params
                     }
-                } for item in must_params
+                } for param in query_params_must
             ]
 
-            if query_params_must_not:
-                must_not_params = [{'match': {name, value}} for name, value in query_params_must_not]
-                for filter in should_filters:
-                    filter['bool']['must_not'] = must_not_params
-
             filters.append(
                 {
                     'bool': {
@@ -274,6 +849,14 @@ class ElasticsearchConnector:
                     }
                 }
             )
+        elif must_not_params:
+            filters.append(
+                {
+                    'bool': {
+                        'must_not': must_not_params
+                    }
+                }
+            )
 
         query = {
             'query': {
@@ -283,25 +866,31 @@ class ElasticsearchConnector:
             },
         }
 
-        if columns:
-            query['_source'] = columns
+        # NOTE: scan sorts by _doc unless order is preserved, which is the cheapest way to scroll
+        if sort_by:
+            query['sort'] = [{sort_by: 'asc'}]
+
+        # project columns on elasticsearch side
+        ids_only = columns == ['_id']
+        if ids_only:
+            # ids are hits' metadata, so sources don't need to be fetched at all
+            source_kwargs = {'_source': False}
+        else:
+            source_kwargs = {'_source_includes': columns}
 
         result = elasticsearch.helpers.scan(
             client=self.es,
             index=es_index_name,
-            doc_type=doc_type,
-            preserve_order=True,
             query=query,
-            request_timeout=request_timeout
+            preserve_order=bool(sort_by),
+            scroll='5m',
+            size=5000,
+            raise_on_error=True,
+            request_timeout=request_timeout,
+            **source_kwargs
         )
-        i = 0
-        data_holder = []
-        for item in result:
-            try:
-                data_holder.append(item['_source'])
-                i += 1
-            except Exception as e:
-                logger.error('failed at iteration {} on item {} with message: {}'.format(i, item, e))
-                raise(e)
-        out = pd.DataFrame(data_holder)
+        if ids_only:
+            return pd.DataFrame({'_id': [hit['_id'] for hit in result]}, columns=columns)
+
+        out = build_df(result, columns=columns)
         return out
\ No newline at end of file
@@ -1,61 +1,109 @@
 from datetime import datetime, timedelta
+from functools import lru_cache
 import numpy as np
 
+# elasticsearch field descriptions for column types
+TYPE_MAP = {
+    np.datetime64: {
+        'type': 'date',
+        'format': 'strict_date_hour_minute_second'
+    },
+    np.float64: {
+        'type': 'float'
+    },
+    np.int64: {
+        'type': 'integer'
+    },
+    str: {
+        'type': 'text'
+    },
+    np.object_: {
+        'type': 'text'
+    }
+}
+DEFAULT_TYPE = {
+    'type': 'text'
+}
+
+
+@lru_cache(maxsize=128)
+def build_query_create_new_index(columns, shards, replicas, bulk_load):
+    '''
+    Prepares a query in a form of dict. Queries are cached, so returned dicts must not be modified.
+    :param columns: tuple of (column name, column type) tuples
+    :param shards: int
+    :param replicas: int
+    :param bulk_load: Boolean
+    :return: dict
+    '''
+    # convert columns into elasticsearch dict description
+    properties = {key: TYPE_MAP.get(value, DEFAULT_TYPE) for key, value in columns}
+
+    index_settings = {
+        'settings': {
+            'number_of_shards': shards,
+            'number_of_replicas': replicas
+        },
+        'mappings': {
+            'dynamic': 'strict',
+            'properties': properties
+        }
+    }
+
+    if bulk_load:
+        # avoid refreshes, replication and fsync per request until the initial load is over
+        index_settings['settings'].update({
+            'number_of_replicas': 0,
+            'refresh_interval': '-1',
+            'translog.durability': 'async',
+            'translog.sync_interval': '30s'
+        })
+
+    return index_settings
+
 
 class ElasticsearchQueries:
 
     @classmethod
-    def get_query_create_new_index(cls, es_index_name, columns, shards=1, replicas=1):
+    def get_query_create_new_index(cls, es_index_name, columns, shards=1, replicas=1, bulk_load=False):
         '''
         Prepares a query in a form of dict.
+        Index created for bulk load has no replicas, refreshes and synchronous translog
+        until settings from get_query_finish_bulk_load are applied.
         :param es_index_name: str
         :param columns: dict
         :param shards: int
         :param replicas: int
+        :param bulk_load: Boolean
         :return: dict
         '''
-        # convert columns into elasticsearch dict description
-        properties = {}
-        for key, value in columns.items():
-            if value == np.datetime64:
-                properties[key] = {
-                    'type': 'date',
-                    'format': 'strict_date_hour_minute_second'
-                }
-                continue
-            if value == np.float64:
-                properties[key] = {
-                    'type': 'float'
-                }
-            if value == str:
-                properties[key] = {
-                    'type': 'text'
-                }
-                continue
-            if value == np.int64:
-                properties[key] = {
-                    'type': 'integer'
-                }
-                continue
-            if value == np.object_:
-                properties[key] = {
-                    'type': 'text'
-                }
+        # sorted tuple of columns is hashable, so built queries can be cached
+        return build_query_create_new_index(
+            columns=tuple(sorted(columns.items())),
+            shards=shards,
+            replicas=replicas,
+            bulk_load=bulk_load
+        )
 
-        index_settings = {
-            'settings': {
-                'number_of_shards': shards,
-                'number_of_replicas': replicas
-            },
-            'mappings': {
-                es_index_name: {
-                    'dynamic': 'strict',
-                    'properties': properties
-                }
+
+    @classmethod
+    def get_query_finish_bulk_load(cls, replicas=1):
+        '''
+        Prepares a query in a form of dict.
+        Restores index settings changed by get_query_create_new_index for bulk load.
+        :param replicas: int
+        :return: dict
+        '''
+        # None resets a setting to its default value, translog.sync_interval is static
+        # and can't be changed on an open index, it has no effect with request durability anyway
+        query = {
+            'index': {
+                'number_of_replicas': replicas,
+                'refresh_interval': None,
+                'translog.durability': None
             }
         }
-
-        return index_settings
+        return query
 
 
     @classmethod
@@ -0,0 +1,309 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+import es_connector
+
+
+def count_bulk_docs(body):
+    lines = body.splitlines() if isinstance(body, (str, bytes)) else body
+    return len(lines) // 2
+
+
+def round_trip(df):
+    output = io.BytesIO()
+    es_connector.dump_cache(df, output)
+    return es_connector.load_cache(io.BytesIO(output.getvalue()), es_connector.DF_CACHE_SUFFIX)
+
+
+def test_cache_round_trips_typed_columns():
+    df = pd.DataFrame({
+        'i': [1, 2],
+        'f': [1.5, np.nan],
+        's': ['x', 'y'],
+        't': pd.to_datetime(['2019-01-01', '2019-01-02'])
+    })
+    pd.testing.assert_frame_equal(round_trip(df), df)
+
+
+def test_cache_round_trips_object_columns():
+    df = pd.DataFrame({
+        'mixed': pd.Series(['x', 3], dtype=object),
+        'lists': pd.Series([[1, 2], None], dtype=object),
+        'dicts': pd.Series([{'a': 1}, {'b': 'y'}], dtype=object),
+        'i': [1, 2]
+    })
+    out = round_trip(df)
+    assert list(out.columns) == ['mixed', 'lists', 'dicts', 'i']
+    assert out['mixed'].tolist() == ['x', 3]
+    assert out['lists'].tolist() == [[1, 2], None]
+    assert out['dicts'].tolist() == [{'a': 1}, {'b': 'y'}]
+    assert out['i'].tolist() == [1, 2]
+
+
+def test_cache_round_trips_empty_df():
+    out = round_trip(pd.DataFrame(columns=['a', 'b']))
+    assert list(out.columns) == ['a', 'b']
+    assert len(out) == 0
+
+
+def test_cacheable_returns_result_if_caching_fails(tmp_path, monkeypatch):
+    monkeypatch.setattr(es_connector, 'cache_dir', tmp_path)
+    monkeypatch.setattr(es_connector, 'redis_on', False)
+    df = pd.DataFrame({'sets': pd.Series([{1}, {2}], dtype=object)})
+
+    @es_connector.cacheable
+    def get_df(**kwargs):
+        return df
+
+    assert get_df(es_index_name='index', start_date=None) is df
+
+
+def test_cacheable_keys_must_params_by_group(tmp_path, monkeypatch):
+    monkeypatch.setattr(es_connector, 'cache_dir', tmp_path)
+    monkeypatch.setattr(es_connector, 'redis_on', False)
+    calls = []
+
+    @es_connector.cacheable
+    def get_df(**kwargs):
+        calls.append(kwargs)
+        return pd.DataFrame({'a': [len(calls)]})
+
+    get_df(es_index_name='index', start_date=None, query_params_must=[{'a': 1, 'b': 2}])
+    get_df(es_index_name='index', start_date=None, query_params_must=[{'a': 1}, {'b': 2}])
+    get_df(es_index_name='index', start_date=None, query_params_must=[{'a': 1}, {'b': 2}], columns=['a'])
+    get_df(es_index_name='index', start_date=None, query_params_must=[{'b': 2}, {'a': 1}], columns=['a'])
+    assert len(calls) == 3
+
+
+def test_bulk_index_retries_rejected_documents(monkeypatch):
+    monkeypatch.setattr(es_connector, 'bulk_initial_backoff', 0)
+    client = es_connector.Elasticsearch()
+    requests = []
+
+    def bulk(body, **kwargs):
+        num_docs = count_bulk_docs(body)
+        requests.append(num_docs)
+        # reject every document of the first request
+        status = 429 if len(requests) == 1 else 201
+        return {'errors': status != 201, 'items': [{'index': {'status': status}} for _ in range(num_docs)]}
+
+    monkeypatch.setattr(client, 'bulk', bulk)
+    df = pd.DataFrame({'a': range(5)})
+    actions = es_connector.iter_bulk_actions(df, 'index')
+    assert es_connector.bulk_index(client, actions, 'index', chunk_size=10) == 0
+    assert requests == [5, 5]
+
+
+def test_bulk_index_counts_documents_failed_after_retries(monkeypatch):
+    monkeypatch.setattr(es_connector, 'bulk_initial_backoff', 0)
+    client = es_connector.Elasticsearch()
+
+    def bulk(body, **kwargs):
+        return {'errors': True, 'items': [{'index': {'status': 429}} for _ in range(count_bulk_docs(body))]}
+
+    monkeypatch.setattr(client, 'bulk', bulk)
+    actions = es_connector.iter_bulk_actions(pd.DataFrame({'a': range(3)}), 'index')
+    assert es_connector.bulk_index(client, actions, 'index', chunk_size=2) == 3
+
+
+def test_redis_client_follows_settings(monkeypatch):
+    monkeypatch.setattr(es_connector, 'redis_host', 'cache-host')
+    monkeypatch.setattr(es_connector, 'redis_port', 6390)
+    kwargs = es_connector.get_redis_client().connection_pool.connection_kwargs
+    assert (kwargs['host'], kwargs['port']) == ('cache-host', 6390)
+
+
+def test_cacheable_recomputes_truncated_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(es_connector, 'cache_dir', tmp_path)
+    monkeypatch.setattr(es_connector, 'redis_on', False)
+    calls = []
+
+    @es_connector.cacheable
+    def get_df(**kwargs):
+        calls.append(kwargs)
+        return pd.DataFrame({'a': range(1000), 's': ['x'] * 1000})
+
+    get_df(es_index_name='index', start_date=None)
+    cache_fpath, = tmp_path.glob('*/*/*' + es_connector.DF_CACHE_SUFFIX)
+    blob = cache_fpath.read_bytes()
+    cache_fpath.write_bytes(blob[:len(blob) // 2])
+
+    assert len(get_df(es_index_name='index', start_date=None)) == 1000
+    assert len(calls) == 2
+    assert cache_fpath.read_bytes() == blob
+    assert not list(tmp_path.glob('*/*/*.tmp'))
+
+
+def test_cacheable_recomputes_cache_with_truncated_arrow_stream(tmp_path, monkeypatch):
+    monkeypatch.setattr(es_connector, 'cache_dir', tmp_path)
+    monkeypatch.setattr(es_connector, 'redis_on', False)
+    df = pd.DataFrame({'a': range(1000)})
+
+    @es_connector.cacheable
+    def get_df(**kwargs):
+        return df
+
+    get_df(es_index_name='index', start_date=None)
+    cache_fpath, = tmp_path.glob('*/*/*' + es_connector.DF_CACHE_SUFFIX)
+    data = es_connector.msgpack.unpackb(es_connector.pack_df(df), raw=False)
+    data['arrow'] = data['arrow'][:len(data['arrow']) // 2]
+    output = io.BytesIO()
+    es_connector.dump_cache(data, output)
+    cache_fpath.write_bytes(output.getvalue())
+
+    pd.testing.assert_frame_equal(get_df(es_index_name='index', start_date=None), df)
+
+
+def test_finish_bulk_load_logs_settings_errors(monkeypatch):
+    connector = es_connector.ElasticsearchConnector('localhost', 9200)
+
+    def put_settings(**kwargs):
+        raise es_connector.elasticsearch.exceptions.ConnectionError('N/A', 'unavailable', None)
+
+    def forcemerge(**kwargs):
+        raise AssertionError('index must not be merged if its settings were not restored')
+
+    monkeypatch.setattr(connector.es.indices, 'put_settings', put_settings)
+    monkeypatch.setattr(connector.es.indices, 'forcemerge', forcemerge)
+    assert not connector.finish_bulk_load('index')
+
+
+def test_put_df_fails_if_index_settings_are_not_restored(monkeypatch):
+    connector = es_connector.ElasticsearchConnector('localhost', 9200)
+    monkeypatch.setattr(connector, 'index_exists', lambda es_index_name: False)
+    monkeypatch.setattr(connector, 'create_es_index', lambda **kwargs: True)
+    monkeypatch.setattr(es_connector, 'bulk_index', lambda **kwargs: 0)
+    monkeypatch.setattr(connector, 'finish_bulk_load', lambda es_index_name, force_merge: False)
+    assert not connector.put_df(es_index_name='index', doc_type=None, df=pd.DataFrame({'a': [1]}))
+
+
+def test_finish_bulk_load_query_only_resets_dynamic_settings():
+    query = es_connector.ElasticsearchQueries.get_query_finish_bulk_load(replicas=2)
+    assert query == {
+        'index': {
+            'number_of_replicas': 2,
+            'refresh_interval': None,
+            'translog.durability': None
+        }
+    }
+
+
+def build_df_in_batches(sources, monkeypatch, columns=None):
+    monkeypatch.setattr(es_connector, 'arrow_batch_size', 2)
+    return es_connector.build_df([{'_source': source} for source in sources], columns=columns)
+
+
+def test_build_df_keeps_leading_nulls_until_type_is_known(monkeypatch):
+    out = build_df_in_batches([{'a': None}, {'a': None}, {'a': None}, {'a': 4}], monkeypatch)
+    assert out['a'].dtype == np.float64
+    assert out['a'].tolist()[3] == 4
+    assert out['a'].isna().tolist() == [True, True, True, False]
+
+
+def test_build_df_promotes_ints_to_floats_across_batches(monkeypatch):
+    out = build_df_in_batches([{'a': 1}, {'a': 2}, {'a': 2.5}, {'a': 3}], monkeypatch)
+    assert out['a'].tolist() == [1.0, 2.0, 2.5, 3.0]
+
+
+def test_build_df_falls_back_to_objects(monkeypatch):
+    sources = [
+        {'mixed': 1, 'big': 1, 'lists': [1], 'big_float': 2 ** 53 + 1, 'float_big': 2.5},
+        {'mixed': 2, 'big': 2 ** 63 + 5, 'lists': None, 'big_float': 1, 'float_big': 3},
+        {'mixed': 'x', 'big': 3, 'lists': [2, 3], 'big_float': 2.5, 'float_big': 2 ** 53 + 1},
+        {'mixed': 4, 'big': 4, 'lists': [], 'big_float': 3, 'float_big': 1}
+    ]
+    out = build_df_in_batches(sources, monkeypatch)
+    assert out['mixed'].tolist() == [1, 2, 'x', 4]
+    assert out['big'].tolist() == [1, 2 ** 63 + 5, 3, 4]
+    assert out['lists'].tolist() == [[1], None, [2, 3], []]
+    assert out['big_float'].tolist() == [2 ** 53 + 1, 1, 2.5, 3]
+    assert out['float_big'].tolist() == [2.5, 3, 2 ** 53 + 1, 1]
+
+
+def test_build_df_backfills_columns_discovered_later(monkeypatch):
+    out = build_df_in_batches([{'a': 1}, {'a': 2}, {'a': 3, 'b': 'x'}], monkeypatch)
+    assert list(out.columns) == ['a', 'b']
+    assert out['b'].tolist()[2] == 'x'
+    assert out['b'].isna().tolist() == [True, True, False]
+
+
+def test_build_df_keeps_requested_columns(monkeypatch):
+    out = build_df_in_batches([{'a': 1}], monkeypatch, columns=['b', 'a'])
+    assert list(out.columns) == ['b', 'a']
+    assert out['b'].tolist() == [None]
+
+
+def build_get_df_query(monkeypatch, **kwargs):
+    monkeypatch.setattr(es_connector, 'caching_on', False)
+    connector = es_connector.ElasticsearchConnector('localhost', 9200)
+    monkeypatch.setattr(connector, 'index_exists', lambda es_index_name: True)
+    queries = []
+
+    def scan(query, **scan_kwargs):
+        queries.append(query)
+        return []
+
+    monkeypatch.setattr(es_connector.elasticsearch.helpers, 'scan', scan)
+    connector.get_df(es_index_name='index', doc_type=None, start_date=None, **kwargs)
+    return queries[0]['query']['bool']['filter']
+
+
+def test_get_df_query_applies_must_not_params_to_each_must_group(monkeypatch):
+    filters = build_get_df_query(
+        monkeypatch,
+        query_params_must=[{'a': 1, 'b': 2}, {'c': 3}],
+        query_params_must_not=[('d', 4)]
+    )
+    must_not = [{'match': {'d': 4}}]
+    assert filters == [
+        {
+            'bool': {
+                'should': [
+                    {'bool': {'must': [{'match': {'a': 1}}, {'match': {'b': 2}}], 'must_not': must_not}},
+                    {'bool': {'must': [{'match': {'c': 3}}], 'must_not': must_not}}
+                ]
+            }
+        }
+    ]
+
+
+def test_get_df_query_applies_must_not_params_alone(monkeypatch):
+    filters = build_get_df_query(monkeypatch, query_params_must_not=[('d', 4), ('e', 'x')])
+    assert filters == [{'bool': {'must_not': [{'match': {'d': 4}}, {'match': {'e': 'x'}}]}}]
+
+
+def test_remove_corrupt_cache_file_keeps_replaced_file(tmp_path):
+    cache_fpath = tmp_path / 'cache.df.zst'
+    cache_fpath.write_bytes(b'valid')
+    es_connector.remove_corrupt_cache_file(cache_fpath, b'corrupt')
+    assert cache_fpath.read_bytes() == b'valid'
+
+    es_connector.remove_corrupt_cache_file(cache_fpath, b'valid')
+    assert not cache_fpath.exists()
+    es_connector.remove_corrupt_cache_file(cache_fpath, b'valid')
+
+
+def test_cacheable_treats_cache_file_removed_by_another_process_as_miss(tmp_path, monkeypatch):
+    monkeypatch.setattr(es_connector, 'cache_dir', tmp_path)
+    monkeypatch.setattr(es_connector, 'redis_on', False)
+    df = pd.DataFrame({'a': [1]})
+
+    @es_connector.cacheable
+    def get_df(**kwargs):
+        return df
+
+    get_df(es_index_name='index', start_date=None)
+    cache_fpath, = tmp_path.glob('*/*/*' + es_connector.DF_CACHE_SUFFIX)
+    load_cache = es_connector.load_cache
+
+    def load_cache_after_removal(input, suffix):
+        cache_fpath.unlink()
+        raise ValueError('corrupt')
+
+    monkeypatch.setattr(es_connector, 'load_cache', load_cache_after_removal)
+    assert get_df(es_index_name='index', start_date=None) is df
+
+    monkeypatch.setattr(es_connector, 'load_cache', load_cache)
+    pd.testing.assert_frame_equal(get_df(es_index_name='index', start_date=None), df)